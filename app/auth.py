@@ -1,28 +1,29 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
 from app import models
 from app.schemas import SignupIn, LoginIn, TokenOut
-from app.security import hash_password, verify_password, create_access_token
+from app.security import ahash_password, averify_password, create_access_token
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 @router.post("/signup", response_model=TokenOut, status_code=201)
-def signup(body: SignupIn, db: Session = Depends(get_db)):
-    existing = db.query(models.AdminUser).filter(models.AdminUser.email == body.email).first()
+async def signup(body: SignupIn, db: AsyncSession = Depends(get_db)):
+    existing = await db.scalar(select(models.AdminUser).where(models.AdminUser.email == body.email))
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
-    user = models.AdminUser(email=body.email, hashed_password=hash_password(body.password))
+    user = models.AdminUser(email=body.email, hashed_password=await ahash_password(body.password))
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     token = create_access_token(str(user.id))
     return {"access_token": token}
 
 @router.post("/login", response_model=TokenOut)
-def login(body: LoginIn, db: Session = Depends(get_db)):
-    user = db.query(models.AdminUser).filter(models.AdminUser.email == body.email).first()
-    if not user or not verify_password(body.password, user.hashed_password):
+async def login(body: LoginIn, db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(models.AdminUser).where(models.AdminUser.email == body.email))
+    if not user or not await averify_password(body.password, user.hashed_password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
     token = create_access_token(str(user.id))
     return {"access_token": token}
\ No newline at end of file
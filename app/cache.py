@@ -3,66 +3,171 @@ Redis caching service for analytics data
 Task 3: Performance optimization
 """
 
-import json
+import os
+import msgspec
 import redis
-from typing import Optional, Dict, Any
+from datetime import datetime, timedelta, timezone
+from itertools import chain
+from redis import asyncio as aioredis
+from redis.asyncio.retry import Retry
+from redis.backoff import ExponentialBackoff
+from typing import Optional, Dict, Any, Iterable, List, Tuple
 from app.config import settings
+from app.schemas import AnalyticsRecord
 import logging
 
 logger = logging.getLogger(__name__)
 
+_analytics_encoder = msgspec.msgpack.Encoder()
+_analytics_decoder = msgspec.msgpack.Decoder(AnalyticsRecord)
+
+def _analytics_key(media_id: int) -> str:
+    return f"analytics:media:{media_id}"
+
+def _views_key(media_id: int) -> str:
+    return f"analytics:views:{media_id}"
+
+def _views_per_day_key(media_id: int) -> str:
+    return f"analytics:vpd:{media_id}"
+
+def _unique_ips_key(media_id: int) -> str:
+    return f"analytics:uip:{media_id}"
+
+def _recent_views_key(media_id: int) -> str:
+    return f"analytics:recent:{media_id}"
+
+def _seed_ips_key(media_id: int, nonce: str) -> str:
+    return f"analytics:uip-seed:{media_id}:{nonce}"
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def _epoch_ms(timestamp: datetime) -> int:
+    """Whole milliseconds since the epoch, exact so it splits views the same way the datetime does"""
+    return (timestamp - _EPOCH) // timedelta(milliseconds=1)
+
+# Log the view in the short recent-views window, then bump the view counters only once
+# they have been seeded from the database, so a partial count is never mistaken for the
+# full history.
+# KEYS: total views, views per day, unique IPs, recent views
+# ARGV: day, viewer IP, timestamp (ms), recent-views member, window start (ms), window (ms)
+_RECORD_VIEW_LUA = """
+redis.call('ZADD', KEYS[4], ARGV[3], ARGV[4])
+redis.call('ZREMRANGEBYSCORE', KEYS[4], '-inf', '(' .. ARGV[5])
+redis.call('PEXPIRE', KEYS[4], ARGV[6])
+local ttl = redis.call('PTTL', KEYS[1])
+if ttl == -2 then
+    return 0
+end
+redis.call('INCR', KEYS[1])
+redis.call('HINCRBY', KEYS[2], ARGV[1], 1)
+redis.call('PFADD', KEYS[3], ARGV[2])
+if ttl > 0 then
+    redis.call('PEXPIRE', KEYS[2], ttl)
+    redis.call('PEXPIRE', KEYS[3], ttl)
+end
+return 1
+"""
+
+# Replace the view counters with the database snapshot of views before the cutoff plus
+# the views logged in the recent-views window from the cutoff on. Runs atomically, so
+# every view is counted either here or by a later _RECORD_VIEW_LUA, never both.
+# KEYS: total views, views per day, unique IPs, recent views, staged snapshot IPs
+# ARGV: counter TTL (ms), cutoff (ms), snapshot total, then snapshot day/count pairs
+_SEED_VIEWS_LUA = """
+redis.call('DEL', KEYS[1], KEYS[2], KEYS[3])
+local total = tonumber(ARGV[3])
+for i = 4, #ARGV, 2 do
+    redis.call('HINCRBY', KEYS[2], ARGV[i], ARGV[i + 1])
+end
+if redis.call('EXISTS', KEYS[5]) == 1 then
+    redis.call('PFMERGE', KEYS[3], KEYS[5])
+    redis.call('DEL', KEYS[5])
+end
+for _, member in ipairs(redis.call('ZRANGEBYSCORE', KEYS[4], ARGV[2], '+inf')) do
+    local day, ip = string.match(member, '^([^|]*)|(.*)|[^|]*$')
+    total = total + 1
+    redis.call('HINCRBY', KEYS[2], day, 1)
+    redis.call('PFADD', KEYS[3], ip)
+end
+redis.call('SET', KEYS[1], total, 'PX', ARGV[1])
+redis.call('PEXPIRE', KEYS[2], ARGV[1])
+redis.call('PEXPIRE', KEYS[3], ARGV[1])
+return total
+"""
+
+_PFADD_CHUNK_SIZE = 10_000
+
 class CacheService:
     def __init__(self):
-        self.redis_client: Optional[redis.Redis] = None
-        self._connect()
+        # Connected from the app lifespan; stays None (no-cache mode) until then
+        self.redis_client: Optional[aioredis.Redis] = None
 
-    def _connect(self):
-        """Connect to Redis with fallback for development"""
-        try:
-            self.redis_client = redis.from_url(
+    @property
+    def enabled(self) -> bool:
+        return self.redis_client is not None
+
+    async def connect(self, client: Optional[aioredis.Redis] = None):
+        """Connect to Redis through a shared blocking pool, with fallback for development"""
+        if client is None:
+            # Requests wait on these calls inline, so a slow or dead server must fail fast
+            pool = aioredis.BlockingConnectionPool.from_url(
                 settings.REDIS_URL,
-                decode_responses=True,
-                socket_connect_timeout=5,
-                socket_timeout=5,
-                retry_on_timeout=True
+                max_connections=settings.REDIS_POOL_SIZE,
+                timeout=settings.REDIS_SOCKET_TIMEOUT,  # seconds to wait for a free connection
+                socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                socket_keepalive=True,
+                retry=Retry(ExponentialBackoff(), settings.REDIS_RETRIES)
             )
+            client = aioredis.Redis.from_pool(pool)
+        try:
+            self._record_view_script = client.register_script(_RECORD_VIEW_LUA)
+            self._seed_views_script = client.register_script(_SEED_VIEWS_LUA)
             # Test connection
-            self.redis_client.ping()
+            await client.ping()
+            self.redis_client = client
             logger.info("✅ Redis connected successfully")
         except (redis.RedisError, ConnectionError) as e:
             logger.warning(f"⚠️  Redis connection failed: {e}. Falling back to no-cache mode.")
+            await client.aclose()
             self.redis_client = None
 
-    def get_analytics(self, media_id: int) -> Optional[Dict[str, Any]]:
+    async def close(self):
+        """Close the Redis connection pool"""
+        if self.redis_client:
+            await self.redis_client.aclose()
+            self.redis_client = None
+
+    async def get_analytics(self, media_id: int) -> Optional[AnalyticsRecord]:
         """Get cached analytics data for media"""
         if not self.redis_client:
             return None
         
         try:
-            cache_key = f"analytics:media:{media_id}"
-            cached_data = self.redis_client.get(cache_key)
+            cache_key = _analytics_key(media_id)
+            cached_data = await self.redis_client.get(cache_key)
             
             if cached_data:
                 logger.info(f"📊 Cache HIT for media {media_id}")
-                return json.loads(cached_data)
+                return _analytics_decoder.decode(cached_data)
             
             logger.info(f"📊 Cache MISS for media {media_id}")
             return None
             
-        except (redis.RedisError, json.JSONDecodeError) as e:
+        except (redis.RedisError, msgspec.DecodeError) as e:
             logger.error(f"Cache get error: {e}")
             return None
 
-    def set_analytics(self, media_id: int, analytics_data: Dict[str, Any]) -> bool:
+    async def set_analytics(self, media_id: int, analytics_data: AnalyticsRecord) -> bool:
         """Cache analytics data for media"""
         if not self.redis_client:
             return False
         
         try:
-            cache_key = f"analytics:media:{media_id}"
-            serialized_data = json.dumps(analytics_data, default=str)  # Handle datetime serialization
+            cache_key = _analytics_key(media_id)
+            serialized_data = _analytics_encoder.encode(analytics_data)
             
-            self.redis_client.setex(
+            await self.redis_client.setex(
                 cache_key, 
                 settings.CACHE_TTL, 
                 serialized_data
@@ -71,18 +176,18 @@ class CacheService:
             logger.info(f"📊 Cached analytics for media {media_id} (TTL: {settings.CACHE_TTL}s)")
             return True
             
-        except (redis.RedisError, json.JSONEncodeError) as e:
+        except (redis.RedisError, msgspec.EncodeError) as e:
             logger.error(f"Cache set error: {e}")
             return False
 
-    def invalidate_analytics(self, media_id: int) -> bool:
+    async def invalidate_analytics(self, media_id: int) -> bool:
         """Invalidate cached analytics when new views are added"""
         if not self.redis_client:
             return False
         
         try:
-            cache_key = f"analytics:media:{media_id}"
-            deleted = self.redis_client.delete(cache_key)
+            cache_key = _analytics_key(media_id)
+            deleted = await self.redis_client.delete(cache_key)
             
             if deleted:
                 logger.info(f"🗑️  Invalidated cache for media {media_id}")
@@ -93,7 +198,148 @@ class CacheService:
             logger.error(f"Cache invalidation error: {e}")
             return False
 
-    def health_check(self) -> Dict[str, Any]:
+    async def get_many_analytics(self, media_ids: List[int]) -> Dict[int, AnalyticsRecord]:
+        """Get cached analytics for several media in a single MGET round-trip"""
+        if not self.redis_client or not media_ids:
+            return {}
+        
+        try:
+            cached_values = await self.redis_client.mget([_analytics_key(media_id) for media_id in media_ids])
+            return {
+                media_id: _analytics_decoder.decode(cached_data)
+                for media_id, cached_data in zip(media_ids, cached_values)
+                if cached_data
+            }
+            
+        except (redis.RedisError, msgspec.DecodeError) as e:
+            logger.error(f"Cache mget error: {e}")
+            return {}
+
+    async def set_many_analytics(self, records: Iterable[AnalyticsRecord]) -> bool:
+        """Cache analytics for several media (bulk warm-up) in one pipelined round-trip"""
+        if not self.redis_client:
+            return False
+        
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for record in records:
+                pipe.setex(
+                    _analytics_key(record.media_id),
+                    settings.CACHE_TTL,
+                    _analytics_encoder.encode(record)
+                )
+            await pipe.execute()
+            return True
+            
+        except (redis.RedisError, msgspec.EncodeError) as e:
+            logger.error(f"Cache mset error: {e}")
+            return False
+
+    async def record_view(self, media_id: int, viewer_ip: str, timestamp: datetime) -> bool:
+        """Invalidate cached analytics and bump the view counters in one round-trip"""
+        if not self.redis_client:
+            return False
+        
+        try:
+            viewed_at = _epoch_ms(timestamp)
+            window = settings.ANALYTICS_SETTLE_MS * 2
+            day = timestamp.date().isoformat()
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.delete(_analytics_key(media_id))
+            await self._record_view_script(
+                keys=[
+                    _views_key(media_id),
+                    _views_per_day_key(media_id),
+                    _unique_ips_key(media_id),
+                    _recent_views_key(media_id)
+                ],
+                # the random suffix keeps same-millisecond views from the same IP apart
+                args=[day, viewer_ip, viewed_at, f"{day}|{viewer_ip}|{os.urandom(4).hex()}", viewed_at - window, window],
+                client=pipe
+            )
+            deleted, _ = await pipe.execute()
+            
+            if deleted:
+                logger.info(f"🗑️  Invalidated cache for media {media_id}")
+            
+            return True
+            
+        except redis.RedisError as e:
+            logger.error(f"Cache record view error: {e}")
+            return False
+
+    async def get_view_counters(self, media_id: int) -> Optional[Tuple[int, int, Dict[str, int]]]:
+        """Get (total views, approx. unique viewers, views per day) from the Redis counters"""
+        if not self.redis_client:
+            return None
+        
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.get(_views_key(media_id))
+            pipe.pfcount(_unique_ips_key(media_id))
+            pipe.hgetall(_views_per_day_key(media_id))
+            total_views, unique_viewers, views_per_day = await pipe.execute()
+            
+            if total_views is None:
+                return None
+            
+            return (
+                int(total_views),
+                unique_viewers,
+                {day.decode(): int(count) for day, count in sorted(views_per_day.items())}
+            )
+            
+        except redis.RedisError as e:
+            logger.error(f"Cache view counters error: {e}")
+            return None
+
+    async def seed_view_counters(
+        self,
+        media_id: int,
+        cutoff: datetime,
+        total_views: int,
+        views_per_day: Dict[str, int],
+        viewer_ips: List[str]
+    ) -> bool:
+        """
+        Initialise the view counters from a database snapshot of the views before cutoff.
+        Views from cutoff on are taken from the recent-views window instead, so cutoff must
+        be old enough that no earlier view is still waiting in a worker's buffer, and recent
+        enough that the window (ANALYTICS_SETTLE_MS * 2) still covers it.
+        """
+        if not self.redis_client:
+            return False
+        
+        try:
+            ttl = settings.ANALYTICS_COUNTER_TTL
+            # Staged under a key of its own so concurrent seeds don't consume each other's IPs
+            ips_key = _seed_ips_key(media_id, os.urandom(4).hex())
+            if viewer_ips:
+                pipe = self.redis_client.pipeline(transaction=False)
+                for i in range(0, len(viewer_ips), _PFADD_CHUNK_SIZE):
+                    pipe.pfadd(ips_key, *viewer_ips[i:i + _PFADD_CHUNK_SIZE])
+                pipe.expire(ips_key, 60)
+                await pipe.execute()
+            
+            await self._seed_views_script(
+                keys=[
+                    _views_key(media_id),
+                    _views_per_day_key(media_id),
+                    _unique_ips_key(media_id),
+                    _recent_views_key(media_id),
+                    ips_key
+                ],
+                args=[ttl * 1000, _epoch_ms(cutoff), total_views, *chain.from_iterable(views_per_day.items())]
+            )
+            
+            logger.info(f"📊 Seeded view counters for media {media_id} (TTL: {ttl}s)")
+            return True
+            
+        except redis.RedisError as e:
+            logger.error(f"Cache seed view counters error: {e}")
+            return False
+
+    async def health_check(self) -> Dict[str, Any]:
         """Check Redis health status"""
         if not self.redis_client:
             return {
@@ -102,7 +348,7 @@ class CacheService:
             }
         
         try:
-            self.redis_client.ping()
+            await self.redis_client.ping()
             return {
                 "status": "healthy",
                 "message": "Redis connection active"
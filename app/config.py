@@ -9,21 +9,44 @@ class Settings(BaseModel):
     JWT_SECRET: str = os.getenv("JWT_SECRET", "dev")
     JWT_ALG: str = os.getenv("JWT_ALG", "HS256")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
+    TOKEN_CACHE_SIZE: int = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))  # decoded-token cache
+    TOKEN_CACHE_TTL: int = int(os.getenv("TOKEN_CACHE_TTL", "300"))
+    USER_CACHE_SIZE: int = int(os.getenv("USER_CACHE_SIZE", "1024"))  # authenticated-user cache
+    USER_CACHE_TTL: int = int(os.getenv("USER_CACHE_TTL", "30"))
+
+    # Password Hashing Configuration (bcrypt cost factor: each +1 doubles hashing time)
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", "12"))
 
     # Stream URL Configuration
     STREAM_SIGNING_SECRET: str = os.getenv("STREAM_SIGNING_SECRET", "dev_stream")
     STREAM_LINK_TTL_SECONDS: int = int(os.getenv("STREAM_LINK_TTL_SECONDS", "600"))
 
     # Database Configuration
-    DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///./media.db")
+    DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./media.db")
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "20"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
 
     # Storage Configuration
     STORAGE_DIR: str = os.getenv("STORAGE_DIR", "./storage")
+    MEDIA_CACHE_SIZE: int = int(os.getenv("MEDIA_CACHE_SIZE", "10000"))  # in-process media row cache
+    MEDIA_CACHE_TTL: int = int(os.getenv("MEDIA_CACHE_TTL", "300"))
     BASE_EXTERNAL_URL: str = os.getenv("BASE_EXTERNAL_URL", "http://127.0.0.1:8000")
+    # Internal nginx location serving STORAGE_DIR (e.g. "/_protected"); empty serves files directly
+    ACCEL_REDIRECT_PREFIX: str = os.getenv("ACCEL_REDIRECT_PREFIX", "").rstrip("/")
 
     # Redis Configuration (Task 3)
     REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
     CACHE_TTL: int = int(os.getenv("CACHE_TTL", "300"))  # 5 minutes default
+    ANALYTICS_COUNTER_TTL: int = int(os.getenv("ANALYTICS_COUNTER_TTL", "86400"))  # reseeded from the DB daily
+    # Longest a view may sit in a worker's view log buffer; counters are seeded from the DB up to this long ago
+    ANALYTICS_SETTLE_MS: int = int(os.getenv("ANALYTICS_SETTLE_MS", "5000"))
+    REDIS_POOL_SIZE: int = int(os.getenv("REDIS_POOL_SIZE", "20"))
+    REDIS_SOCKET_TIMEOUT: float = float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.5"))  # seconds; requests wait on it
+    REDIS_RETRIES: int = int(os.getenv("REDIS_RETRIES", "1"))
+
+    # View Log Batching Configuration
+    VIEW_LOG_BATCH_SIZE: int = int(os.getenv("VIEW_LOG_BATCH_SIZE", "500"))
+    VIEW_LOG_FLUSH_INTERVAL_MS: int = int(os.getenv("VIEW_LOG_FLUSH_INTERVAL_MS", "200"))
 
     # Rate Limiting Configuration (Task 3)
     RATE_LIMIT_PER_MINUTE: int = int(os.getenv("RATE_LIMIT_PER_MINUTE", "10"))
@@ -1,15 +1,37 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from app.database import engine, Base
+from fastapi.responses import ORJSONResponse
+from app.database import engine, Base, SessionLocal
 from app.auth import router as auth_router
 from app.media import router as media_router
+from app.view_log_buffer import view_log_buffer
+from app.cache import cache_service
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Password hashing runs on the default executor; size it so logins use every core
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=(os.cpu_count() or 1) * 2, thread_name_prefix="default-executor")
+    )
+    # Create tables
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await cache_service.connect()
+    view_log_buffer.start(SessionLocal)
+    yield
+    await view_log_buffer.stop()
+    await cache_service.close()
+    await engine.dispose()
 
 app = FastAPI(
     title="Media Platform Backend",
     description="Upload media and generate secure streaming links",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
 app.include_router(auth_router)
@@ -1,20 +1,26 @@
 from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, Request
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import func, distinct
+from fastapi.responses import FileResponse, ORJSONResponse, Response
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, distinct, select, case
 from pathlib import Path
-from typing import Literal
-from datetime import datetime, date, timedelta
-from collections import defaultdict
+from typing import Literal, NamedTuple
+from urllib.parse import quote
+from datetime import datetime, timedelta, timezone
+from cachetools import TTLCache
 from app.database import get_db
 from app import models
-from app.schemas import MediaCreateOut, StreamURLOut, ViewLogOut, AnalyticsOut
+from app.schemas import MediaCreateOut, StreamURLOut, ViewLogOut, AnalyticsOut, AnalyticsRecord
 from app.security import get_current_user
 from app.config import settings
 from app.utils import generate_stream_url, verify_stream_signature
 from app.cache import cache_service
 from app.rate_limiter import rate_limit_dependency
-import uuid
+from app.view_log_buffer import view_log_buffer
+import os
+import time
+import secrets
+import msgspec
 import logging
 
 logger = logging.getLogger(__name__)
@@ -23,96 +29,153 @@ router = APIRouter(prefix="/media", tags=["media"])
 
 STORAGE = Path(settings.STORAGE_DIR)
 STORAGE.mkdir(exist_ok=True, parents=True)
+_STORAGE_ABS = str(STORAGE.resolve())  # resolved once, not per upload
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+
+class _MediaInfo(NamedTuple):
+    """Detached copy of a MediaAsset row (rows don't change after upload)"""
+    id: int
+    title: str
+    type: models.MediaType
+    file_url: str
+    created_at: datetime
+
+_media_cache: TTLCache = TTLCache(maxsize=settings.MEDIA_CACHE_SIZE, ttl=settings.MEDIA_CACHE_TTL)
+
+def _cache_media(media: models.MediaAsset) -> _MediaInfo:
+    info = _MediaInfo(media.id, media.title, media.type, media.file_url, media.created_at)
+    _media_cache[media.id] = info
+    return info
+
+async def _get_media(db: AsyncSession, media_id: int) -> _MediaInfo:
+    """Look up a media asset, from process memory when possible; 404 if it doesn't exist"""
+    info = _media_cache.get(media_id)
+    if info is None:
+        media = await db.scalar(select(models.MediaAsset).where(models.MediaAsset.id == media_id))
+        if not media:
+            raise HTTPException(status_code=404, detail="Media not found")
+        info = _cache_media(media)
+    return info
+
+def _save_upload(src, dest: str) -> None:
+    """Copy an upload to disk chunk by chunk so memory stays O(chunk)"""
+    fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        while chunk := src.read(UPLOAD_CHUNK_SIZE):
+            view = memoryview(chunk)
+            while view:
+                view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+# Form input is already validated by the Literal annotation
+_TYPE_MAP = {"video": models.MediaType.video, "audio": models.MediaType.audio}
 
 @router.post("/", response_model=MediaCreateOut)
-def create_media(
+async def create_media(
     title: str = Form(...),
     type: Literal["video", "audio"] = Form(...),
     file: UploadFile = File(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user = Depends(get_current_user),
 ):
     # save file to storage
-    suffix = Path(file.filename or "").suffix.lower()
-    safe_name = f"{uuid.uuid4().hex}{suffix}"
-    dest = STORAGE / safe_name
+    suffix = os.path.splitext(file.filename or "")[1].lower()
+    safe_name = f"{secrets.token_hex(16)}{suffix}"
+    file_url = f"{_STORAGE_ABS}/{safe_name}"
 
-    with dest.open("wb") as f:
-        content = file.file.read()
-        f.write(content)
+    await run_in_threadpool(_save_upload, file.file, file_url)
 
     # create record
     media = models.MediaAsset(
         title=title,
-        type=models.MediaType(type),
-        file_url=str(dest.resolve())
+        type=_TYPE_MAP[type],
+        file_url=file_url
     )
     db.add(media)
-    db.commit()
-    db.refresh(media)
+    await db.commit()
+    await db.refresh(media)
+    _cache_media(media)
 
     return MediaCreateOut(
         id=media.id,
         title=media.title,
-        type=media.type.value,
+        type=type,
         file_url=media.file_url
     )
 
 @router.get("/{media_id}/stream-url", response_model=StreamURLOut)
-def get_stream_url(
+async def get_stream_url(
     media_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user = Depends(get_current_user),
 ):
-    media = db.query(models.MediaAsset).filter(models.MediaAsset.id == media_id).first()
-    if not media:
-        raise HTTPException(status_code=404, detail="Media not found")
+    await _get_media(db, media_id)
     
     url = generate_stream_url(media_id)
-    return StreamURLOut(stream_url=url)
+    # Returning a Response skips response_model re-validation (the model still documents it)
+    return ORJSONResponse({"stream_url": url})
 
 # Public streaming endpoint (no auth required)
 @router.get("/stream/{media_id}")
-def stream_media(
+async def stream_media(
     media_id: int,
     exp: int,
     sig: str,
     request: Request,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
+    # reject stale links before spending any signing work on them
+    now = int(time.time())
+    if exp < now:
+        raise HTTPException(status_code=403, detail="Expired link")
+    
     # verify signature
     path = f"/media/stream/{media_id}"
-    if not verify_stream_signature(path, exp, sig):
+    if not verify_stream_signature(path, exp, sig, now):
         raise HTTPException(status_code=403, detail="Invalid or expired link")
     
     # find media
-    media = db.query(models.MediaAsset).filter(models.MediaAsset.id == media_id).first()
-    if not media:
-        raise HTTPException(status_code=404, detail="Media not found")
+    media = await _get_media(db, media_id)
     
-    # log the view
+    # log the view (written to the database in batches) and count it in Redis
     client_ip = request.client.host if request.client else "unknown"
-    log_entry = models.MediaViewLog(media_id=media_id, viewed_by_ip=client_ip)
-    db.add(log_entry)
-    db.commit()
+    timestamp = view_log_buffer.add(media_id, client_ip)
+    await cache_service.record_view(media_id, client_ip, timestamp)
     
-    # serve file
+    # serve file (a single stat, reused by FileResponse)
     file_path = Path(media.file_url)
-    if not file_path.exists():
+    try:
+        stat_result = os.stat(file_path)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="File not found on disk")
     
+    filename = f"{media.title}{file_path.suffix}"
+    
+    # Behind nginx: hand the transfer to an internal location so nginx sendfile()s it
+    if settings.ACCEL_REDIRECT_PREFIX:
+        return Response(
+            media_type="application/octet-stream",
+            headers={
+                "X-Accel-Redirect": f"{settings.ACCEL_REDIRECT_PREFIX}/{file_path.name}",
+                "Content-Disposition": f"attachment; filename*=utf-8''{quote(filename)}",
+            },
+        )
+    
     return FileResponse(
         path=file_path,
-        filename=f"{media.title}{file_path.suffix}",
-        media_type="application/octet-stream"
+        filename=filename,
+        media_type="application/octet-stream",
+        stat_result=stat_result
     )
 
 # Task 2: Manual view logging endpoint with Task 3 rate limiting
 @router.post("/{media_id}/view", response_model=ViewLogOut)
-def log_media_view(
+async def log_media_view(
     media_id: int,
     request: Request,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user = Depends(get_current_user),  # JWT protected
     rate_limit_info = Depends(rate_limit_dependency)  # Task 3: Rate limiting
 ):
@@ -122,39 +185,83 @@ def log_media_view(
     Task 3: Rate limited to prevent abuse.
     """
     # Check if media exists
-    media = db.query(models.MediaAsset).filter(models.MediaAsset.id == media_id).first()
-    if not media:
-        raise HTTPException(status_code=404, detail="Media not found")
+    await _get_media(db, media_id)
     
     # Get client IP
     client_ip = request.client.host if request.client else "unknown"
     
-    # Create view log entry
-    view_log = models.MediaViewLog(
-        media_id=media_id,
-        viewed_by_ip=client_ip
-    )
-    db.add(view_log)
-    db.commit()
-    db.refresh(view_log)
+    # Queue view log entry (written to the database in batches)
+    timestamp = view_log_buffer.add(media_id, client_ip)
     
-    # Task 3: Invalidate analytics cache when new view is added
-    cache_service.invalidate_analytics(media_id)
+    # Task 3: Invalidate analytics cache and bump the view counters when new view is added
+    await cache_service.record_view(media_id, client_ip, timestamp)
     
     logger.info(f"📊 View logged for media {media_id} by {client_ip}")
     
     return ViewLogOut(
         message="View logged successfully",
         media_id=media_id,
-        timestamp=view_log.timestamp,
+        timestamp=timestamp,
         viewer_ip=client_ip
     )
 
+_analytics_json_encoder = msgspec.json.Encoder()
+
+def _analytics_response(analytics: AnalyticsRecord) -> Response:
+    """Encode the Struct straight to JSON, skipping response_model re-validation"""
+    return Response(content=_analytics_json_encoder.encode(analytics), media_type="application/json")
+
+async def _aggregate_views(db: AsyncSession, media_id: int, recent_since: datetime):
+    """Compute view analytics from media_view_logs"""
+    # Make sure this media's queued views are counted (the rest wait for the background flusher)
+    await view_log_buffer.flush_media(db, media_id)
+    
+    # Calculate analytics from database in a single aggregated query
+    total_views, unique_viewers, recent_views = (await db.execute(
+        select(
+            func.count(models.MediaViewLog.id),
+            func.count(func.distinct(models.MediaViewLog.viewed_by_ip)),
+            func.sum(case((models.MediaViewLog.timestamp >= recent_since, 1), else_=0)),
+        ).where(models.MediaViewLog.media_id == media_id)
+    )).one()
+    recent_views = recent_views or 0
+    
+    view_day = func.date(models.MediaViewLog.timestamp).label("day")
+    views_per_day = {
+        str(day): count
+        for day, count in await db.execute(
+            select(view_day, func.count(models.MediaViewLog.id))
+            .where(models.MediaViewLog.media_id == media_id)
+            .group_by(view_day)
+            .order_by(view_day)
+        )
+    }
+    
+    return total_views, unique_viewers, recent_views, views_per_day
+
+async def _seed_view_counters(db: AsyncSession, media_id: int) -> bool:
+    """Seed the Redis view counters from the views old enough to have left every worker's buffer"""
+    cutoff = datetime.now(timezone.utc) - timedelta(milliseconds=settings.ANALYTICS_SETTLE_MS)
+    cutoff = cutoff.replace(microsecond=cutoff.microsecond // 1000 * 1000)  # whole ms, like the Redis side
+    settled = (models.MediaViewLog.media_id == media_id, models.MediaViewLog.timestamp < cutoff)
+    
+    total_views = await db.scalar(select(func.count(models.MediaViewLog.id)).where(*settled))
+    view_day = func.date(models.MediaViewLog.timestamp).label("day")
+    views_per_day = {
+        str(day): count
+        for day, count in await db.execute(
+            select(view_day, func.count(models.MediaViewLog.id)).where(*settled).group_by(view_day)
+        )
+    }
+    viewer_ips = (await db.scalars(select(distinct(models.MediaViewLog.viewed_by_ip)).where(*settled))).all()
+    
+    return await cache_service.seed_view_counters(media_id, cutoff, total_views, views_per_day, list(viewer_ips))
+
 # Task 2: Analytics endpoint with Task 3 caching
 @router.get("/{media_id}/analytics", response_model=AnalyticsOut)
-def get_media_analytics(
+async def get_media_analytics(
     media_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user = Depends(get_current_user),  # JWT protected
 ):
     """
@@ -163,42 +270,41 @@ def get_media_analytics(
     Task 3: Cached for performance optimization.
     """
     # Check if media exists
-    media = db.query(models.MediaAsset).filter(models.MediaAsset.id == media_id).first()
-    if not media:
-        raise HTTPException(status_code=404, detail="Media not found")
+    media = await _get_media(db, media_id)
     
     # Task 3: Try to get from cache first
-    cached_analytics = cache_service.get_analytics(media_id)
+    cached_analytics = await cache_service.get_analytics(media_id)
     if cached_analytics:
         logger.info(f"📈 Analytics cache hit for media {media_id}")
-        return cached_analytics
-    
-    # Calculate analytics from database
-    total_views = db.query(func.count(models.MediaViewLog.id)).filter(
-        models.MediaViewLog.media_id == media_id
-    ).scalar() or 0
+        return _analytics_response(cached_analytics)
     
-    unique_viewers = db.query(func.count(func.distinct(models.MediaViewLog.viewed_by_ip))).filter(
-        models.MediaViewLog.media_id == media_id
-    ).scalar() or 0
+    # Whole days, the granularity of the per-day counters, so both sources agree
+    recent_since = (datetime.now(timezone.utc) - timedelta(days=7)).replace(hour=0, minute=0, second=0, microsecond=0)
     
-    recent_views = db.query(func.count(models.MediaViewLog.id)).filter(
-        models.MediaViewLog.media_id == media_id,
-        models.MediaViewLog.timestamp >= (datetime.utcnow() - timedelta(days=7))
-    ).scalar() or 0
+    # Rolling Redis counters answer without touching media_view_logs (seeded from it once per TTL)
+    counters = await cache_service.get_view_counters(media_id)
+    if counters is None and cache_service.enabled and await _seed_view_counters(db, media_id):
+        counters = await cache_service.get_view_counters(media_id)
+    if counters:
+        total_views, unique_viewers, views_per_day = counters
+        recent_day = recent_since.date().isoformat()
+        recent_views = sum(count for day, count in views_per_day.items() if day >= recent_day)
+    else:
+        total_views, unique_viewers, recent_views, views_per_day = await _aggregate_views(db, media_id, recent_since)
     
-    analytics_data = AnalyticsOut(
+    analytics_data = AnalyticsRecord(
         media_id=media_id,
         media_filename=media.title,
         total_views=total_views,
         unique_viewers=unique_viewers,
         recent_views_7days=recent_views,
+        views_per_day=views_per_day,
         upload_date=media.created_at
     )
     
     # Task 3: Cache the analytics data
-    cache_service.set_analytics(media_id, analytics_data)
+    await cache_service.set_analytics(media_id, analytics_data)
     
     logger.info(f"📊 Analytics calculated and cached for media {media_id}")
     
-    return analytics_data
\ No newline at end of file
+    return _analytics_response(analytics_data)
\ No newline at end of file
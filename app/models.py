@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum as SAEnum
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, Enum as SAEnum
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from enum import Enum
@@ -25,8 +25,13 @@ class MediaAsset(Base):
 
 class MediaViewLog(Base):
     __tablename__ = "media_view_logs"
+    # Composite indexes serve the per-media analytics aggregates (and plain media_id lookups)
+    __table_args__ = (
+        Index("ix_mvl_media_ts", "media_id", "timestamp"),
+        Index("ix_mvl_media_ip", "media_id", "viewed_by_ip"),
+    )
     id = Column(Integer, primary_key=True)
-    media_id = Column(Integer, ForeignKey("media_assets.id", ondelete="CASCADE"), index=True, nullable=False)
+    media_id = Column(Integer, ForeignKey("media_assets.id", ondelete="CASCADE"), nullable=False)
     viewed_by_ip = Column(String, nullable=False)
     timestamp = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
@@ -3,20 +3,54 @@ Rate limiting service for API endpoints
 Task 3: Security and abuse prevention
 """
 
+import math
 import time
+import redis
 from typing import Dict, Tuple
-from collections import defaultdict, deque
 from fastapi import HTTPException, Request
 from app.config import settings
+from app.cache import cache_service
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Atomic token bucket shared by every worker: refill, take a token, store, expire.
+# KEYS[1]: bucket; ARGV: capacity, refill rate (tokens/ms), now (ms), ttl (ms)
+_TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local last = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - last) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], ARGV[4])
+return {allowed, tostring(tokens)}
+"""
+
 class RateLimiter:
     def __init__(self):
-        # In-memory storage for rate limiting (in production, use Redis)
-        self._requests: Dict[str, deque] = defaultdict(deque)
-        self._window_size = 60  # 1 minute window
+        # In-memory token buckets: client id -> (tokens, last refill on the monotonic clock)
+        # Used when Redis is not available
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._window_size = 60  # limit is expressed per minute
+        self._redis_bucket = None
+    
+    def _bucket_script(self):
+        """Token bucket script, registered on first use with the current Redis client"""
+        client = cache_service.redis_client
+        if client is None:
+            return None
+        # Re-register after a reconnect: the old script would run on the closed client
+        if self._redis_bucket is None or self._redis_bucket.registered_client is not client:
+            self._redis_bucket = client.register_script(_TOKEN_BUCKET_LUA)
+        return self._redis_bucket
         
     def _get_client_id(self, request: Request) -> str:
         """Get client identifier from request"""
@@ -32,53 +66,64 @@ class RateLimiter:
         # Fallback to client host
         return request.client.host if request.client else "unknown"
     
-    def _cleanup_old_requests(self, requests_deque: deque, current_time: float):
-        """Remove requests outside the time window"""
-        while requests_deque and current_time - requests_deque[0] > self._window_size:
-            requests_deque.popleft()
+    async def _take_token(self, client_id: str, capacity: int, refill_rate: float) -> Tuple[bool, float]:
+        """Take a token from the client's bucket, returning (allowed, tokens left)"""
+        redis_bucket = self._bucket_script()
+        if redis_bucket:
+            try:
+                allowed, tokens = await redis_bucket(
+                    keys=[f"rl:{client_id}"],
+                    args=[capacity, refill_rate / 1000, int(time.time() * 1000), self._window_size * 2000]
+                )
+                return bool(allowed), float(tokens)
+            except redis.RedisError as e:
+                logger.error(f"Redis rate limit error, using in-process bucket: {e}")
+        
+        return self._take_local_token(client_id, capacity, refill_rate)
+    
+    def _take_local_token(self, client_id: str, capacity: int, refill_rate: float) -> Tuple[bool, float]:
+        """In-process fallback: per-worker bucket refilled for the time since the last request"""
+        now = time.monotonic()
+        tokens, last_refill = self._buckets.get(client_id, (capacity, now))
+        tokens = min(capacity, tokens + (now - last_refill) * refill_rate)
+        
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[client_id] = (tokens, now)
+        return allowed, tokens
     
-    def check_rate_limit(self, request: Request) -> Tuple[bool, Dict[str, int]]:
+    async def check_rate_limit(self, request: Request) -> Tuple[bool, Dict[str, int]]:
         """
-        Check if request is within rate limit
+        Check if request is within rate limit (token bucket, one Redis round-trip per check)
         Returns (allowed, rate_limit_info)
         """
         client_id = self._get_client_id(request)
-        current_time = time.time()
-        
-        # Get client's request history
-        client_requests = self._requests[client_id]
-        
-        # Clean up old requests
-        self._cleanup_old_requests(client_requests, current_time)
+        capacity = settings.RATE_LIMIT_PER_MINUTE
+        refill_rate = capacity / self._window_size  # tokens per second
         
-        # Check if within limit
-        current_count = len(client_requests)
-        limit = settings.RATE_LIMIT_PER_MINUTE
+        allowed, tokens = await self._take_token(client_id, capacity, refill_rate)
         
         rate_limit_info = {
-            "limit": limit,
-            "remaining": max(0, limit - current_count),
-            "reset_at": int(current_time + self._window_size),
-            "current_count": current_count
+            "limit": capacity,
+            "remaining": int(tokens),
+            "reset_at": int(time.time() + (capacity - tokens) / refill_rate),
+            "retry_after": 0 if allowed else math.ceil((1 - tokens) / refill_rate),
+            "current_count": capacity - int(tokens)
         }
         
-        if current_count >= limit:
-            logger.warning(f"🚫 Rate limit exceeded for {client_id}: {current_count}/{limit}")
+        if not allowed:
+            logger.warning(f"🚫 Rate limit exceeded for {client_id}: {rate_limit_info['current_count']}/{capacity}")
             return False, rate_limit_info
         
-        # Add current request
-        client_requests.append(current_time)
-        rate_limit_info["remaining"] -= 1
-        rate_limit_info["current_count"] += 1
-        
-        logger.debug(f"✅ Rate limit OK for {client_id}: {rate_limit_info['current_count']}/{limit}")
+        logger.debug(f"✅ Rate limit OK for {client_id}: {rate_limit_info['current_count']}/{capacity}")
         return True, rate_limit_info
     
-    def enforce_rate_limit(self, request: Request):
+    async def enforce_rate_limit(self, request: Request):
         """
         Enforce rate limit, raise HTTPException if exceeded
         """
-        allowed, rate_info = self.check_rate_limit(request)
+        allowed, rate_info = await self.check_rate_limit(request)
         
         if not allowed:
             raise HTTPException(
@@ -87,7 +132,7 @@ class RateLimiter:
                     "message": "Rate limit exceeded. Too many requests.",
                     "limit": rate_info["limit"],
                     "reset_at": rate_info["reset_at"],
-                    "retry_after": 60
+                    "retry_after": rate_info["retry_after"]
                 }
             )
         
@@ -96,6 +141,6 @@ class RateLimiter:
 # Global rate limiter instance
 rate_limiter = RateLimiter()
 
-def rate_limit_dependency(request: Request):
+async def rate_limit_dependency(request: Request):
     """FastAPI dependency for rate limiting"""
-    return rate_limiter.enforce_rate_limit(request)
+    return await rate_limiter.enforce_rate_limit(request)
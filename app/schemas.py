@@ -1,4 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field
+import msgspec
 from typing import Literal, Dict
 from datetime import datetime
 
@@ -35,4 +36,15 @@ class AnalyticsOut(BaseModel):
     total_views: int
     unique_viewers: int
     recent_views_7days: int
+    views_per_day: Dict[str, int]
+    upload_date: datetime
+
+class AnalyticsRecord(msgspec.Struct):
+    """Analytics payload as stored in the cache (msgpack encoded)"""
+    media_id: int
+    media_filename: str
+    total_views: int
+    unique_viewers: int
+    recent_views_7days: int
+    views_per_day: Dict[str, int]
     upload_date: datetime
\ No newline at end of file
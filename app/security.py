@@ -1,46 +1,109 @@
-from datetime import datetime, timedelta, timezone
-from jose import jwt, JWTError
+import asyncio
+import base64
+import hashlib
+import hmac
+import time
+import jwt
+from functools import lru_cache
+from jwt import InvalidTokenError as JWTError
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from passlib.context import CryptContext
+from sqlalchemy.ext.asyncio import AsyncSession
+import bcrypt
+import orjson
+from cachetools import TTLCache
 from app.config import settings
 from app.database import get_db
 from app import models
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
-# Password helpers
+# Password helpers (bcrypt only reads the first 72 bytes; truncate explicitly like passlib did)
+
+BCRYPT_MAX_BYTES = 72
 
 def hash_password(p: str) -> str:
-    return pwd_context.hash(p)
+    salt = bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS)
+    return bcrypt.hashpw(p.encode()[:BCRYPT_MAX_BYTES], salt).decode()
 
 def verify_password(p: str, hashed: str) -> bool:
-    return pwd_context.verify(p, hashed)
+    try:
+        return bcrypt.checkpw(p.encode()[:BCRYPT_MAX_BYTES], hashed.encode())
+    except ValueError:  # malformed stored hash
+        return False
+
+# bcrypt releases the GIL, so async callers run it on the loop's executor threads
+# instead of blocking the event loop for the whole hash
+
+async def ahash_password(p: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(None, hash_password, p)
+
+async def averify_password(p: str, hashed: str) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(None, verify_password, p, hashed)
 
 # JWT helpers
 
+# raw token -> (subject, exp epoch); entries also age out after TOKEN_CACHE_TTL
+_token_cache: TTLCache = TTLCache(maxsize=settings.TOKEN_CACHE_SIZE, ttl=settings.TOKEN_CACHE_TTL)
+
+# user id -> (id, email); plain values, since ORM instances are bound to the session that loaded them
+_user_cache: TTLCache = TTLCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL)
+
+def _b64url(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+# HMAC tokens are assembled by hand around a pre-encoded header; any other algorithm goes
+# through PyJWT. Secret and algorithm are read from settings per call, as jwt.decode does
+_JWT_HMAC_DIGESTS = {"HS256": hashlib.sha256, "HS384": hashlib.sha384, "HS512": hashlib.sha512}
+
+@lru_cache(maxsize=None)
+def _jwt_header_b64(alg: str) -> bytes:
+    return _b64url(orjson.dumps({"alg": alg, "typ": "JWT"}))
+
 def create_access_token(subject: str) -> str:
-    expire = datetime.now(timezone.utc) + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    payload = {"sub": subject, "exp": expire}
-    return jwt.encode(payload, settings.JWT_SECRET, algorithm=settings.JWT_ALG)
+    payload = {"sub": subject, "exp": int(time.time()) + settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60}
+    digest = _JWT_HMAC_DIGESTS.get(settings.JWT_ALG)
+    if digest is None:
+        return jwt.encode(payload, settings.JWT_SECRET, algorithm=settings.JWT_ALG)
 
-async def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)) -> models.AdminUser:
+    signing_input = _jwt_header_b64(settings.JWT_ALG) + b"." + _b64url(orjson.dumps(payload))
+    signature = hmac.digest(settings.JWT_SECRET.encode(), signing_input, digest)
+    return (signing_input + b"." + _b64url(signature)).decode()
+
+async def get_current_user(db: AsyncSession = Depends(get_db), token: str = Depends(oauth2_scheme)) -> models.AdminUser:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALG])
-        sub: str | None = payload.get("sub")
-        if sub is None:
+    # Skip re-verifying a token we've already decoded, until it expires
+    cached = _token_cache.get(token)
+    if cached and cached[1] > time.time():
+        sub = cached[0]
+    else:
+        try:
+            payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALG])
+            sub: str | None = payload.get("sub")
+            if sub is None:
+                raise credentials_exception
+        except JWTError:
             raise credentials_exception
-    except JWTError:
+        if payload.get("exp") is not None:
+            _token_cache[token] = (sub, payload["exp"])
+
+    try:
+        user_id = int(sub)
+    except (TypeError, ValueError):
         raise credentials_exception
 
-    user = db.query(models.AdminUser).filter(models.AdminUser.id == int(sub)).first()
+    # Recently seen users skip the database; the result is a detached AdminUser
+    cached_user = _user_cache.get(user_id)
+    if cached_user:
+        return models.AdminUser(id=cached_user[0], email=cached_user[1])
+
+    # Primary-key lookup goes through the session's identity map first
+    user = await db.get(models.AdminUser, user_id)
     if not user:
         raise credentials_exception
+    _user_cache[user_id] = (user.id, user.email)
     return user
\ No newline at end of file
@@ -1,25 +1,37 @@
 import hmac, hashlib, time
-from urllib.parse import urlencode
+from typing import Optional
 from app.config import settings
 
-# HMAC signer for stream URLs
+# Keyed BLAKE2b signer for stream URLs (a MAC by construction, no HMAC wrapper)
+
+_STREAM_KEY = settings.STREAM_SIGNING_SECRET.encode()
+# blake2b accepts keys up to 64 bytes; longer secrets are compressed rather than cut
+_SIGNING_KEY = _STREAM_KEY if len(_STREAM_KEY) <= 64 else hashlib.blake2b(_STREAM_KEY).digest()
+_SIG_DIGEST_SIZE = 16
+_SIG_HEX_LEN = _SIG_DIGEST_SIZE * 2
+_BASE_URL = settings.BASE_EXTERNAL_URL
 
 def sign_stream_path(path: str, exp_epoch: int) -> str:
     message = f"{path}?exp={exp_epoch}".encode()
-    key = settings.STREAM_SIGNING_SECRET.encode()
-    signature = hmac.new(key, message, hashlib.sha256).hexdigest()
-    return signature
+    return hashlib.blake2b(message, key=_SIGNING_KEY, digest_size=_SIG_DIGEST_SIZE).hexdigest()
 
 def generate_stream_url(media_id: int) -> str:
     # path that the client will actually hit to get the file
     path = f"/media/stream/{media_id}"
     exp = int(time.time()) + settings.STREAM_LINK_TTL_SECONDS
     sig = sign_stream_path(path, exp)
-    query = urlencode({"exp": exp, "sig": sig})
-    return f"{settings.BASE_EXTERNAL_URL}{path}?{query}"
+    # exp is an int and sig is hex, so neither needs URL-escaping
+    return f"{_BASE_URL}{path}?exp={exp}&sig={sig}"
 
-def verify_stream_signature(path: str, exp: int, sig: str) -> bool:
-    if exp < int(time.time()):
+def verify_stream_signature(path: str, exp: int, sig: str, now: Optional[int] = None) -> bool:
+    # callers that already read the clock pass it in instead of reading it again
+    if now is None:
+        now = int(time.time())
+    if exp < now:
+        return False
+    # the signature length is fixed and public, so a malformed one is rejected before hashing
+    # (compare_digest also raises on non-ASCII str)
+    if len(sig) != _SIG_HEX_LEN or not sig.isascii():
         return False
     expected = sign_stream_path(path, exp)
     return hmac.compare_digest(expected, sig)
\ No newline at end of file
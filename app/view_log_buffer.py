@@ -0,0 +1,132 @@
+"""
+Buffered writer for media view logs
+Keeps per-view INSERT + commit off the streaming hot path
+"""
+
+import asyncio
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from app.config import settings
+from app import models
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ViewLogBuffer:
+    def __init__(self):
+        self._pending: Deque[Dict[str, Any]] = deque()
+        self._flush_lock = asyncio.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._session_factory: Optional[async_sessionmaker] = None
+
+    def add(self, media_id: int, viewer_ip: str, timestamp: Optional[datetime] = None) -> datetime:
+        """Queue a view log entry and return its timestamp"""
+        if timestamp is None:
+            timestamp = datetime.now(timezone.utc)
+        self._pending.append({"media_id": media_id, "viewed_by_ip": viewer_ip, "timestamp": timestamp})
+
+        # Wake the flusher early once a full batch is waiting
+        if self._wakeup and len(self._pending) >= settings.VIEW_LOG_BATCH_SIZE:
+            self._wakeup.set()
+
+        return timestamp
+
+    async def flush(self, db: AsyncSession) -> int:
+        """Write all pending entries with batched INSERTs, one commit per batch"""
+        flushed = 0
+        async with self._flush_lock:
+            while self._pending:
+                batch_size = min(len(self._pending), settings.VIEW_LOG_BATCH_SIZE)
+                batch = [self._pending.popleft() for _ in range(batch_size)]
+                await self._write(db, batch)
+                flushed += batch_size
+
+        if flushed:
+            logger.debug(f"📝 Flushed {flushed} view logs")
+        return flushed
+
+    async def flush_media(self, db: AsyncSession, media_id: int) -> int:
+        """Write just one media's pending entries, leaving the rest to the background flusher"""
+        entries = [entry for entry in self._pending if entry["media_id"] == media_id]
+        if not entries:
+            return 0
+        # Taken off the queue before the first await, so the flusher can't write them twice
+        self._pending = deque(entry for entry in self._pending if entry["media_id"] != media_id)
+
+        for i in range(0, len(entries), settings.VIEW_LOG_BATCH_SIZE):
+            try:
+                await self._write(db, entries[i:i + settings.VIEW_LOG_BATCH_SIZE])
+            except BaseException:
+                # _write re-queued its batch; the later ones were never attempted
+                self._pending.extendleft(reversed(entries[i + settings.VIEW_LOG_BATCH_SIZE:]))
+                raise
+
+        logger.debug(f"📝 Flushed {len(entries)} view logs for media {media_id}")
+        return len(entries)
+
+    async def _write(self, db: AsyncSession, batch: List[Dict[str, Any]]):
+        """INSERT and commit one batch, putting it back at the front of the queue on failure"""
+        try:
+            await db.execute(insert(models.MediaViewLog), batch)
+            await db.commit()
+        except SQLAlchemyError:
+            # Keep the entries for the next attempt
+            self._pending.extendleft(reversed(batch))
+            await db.rollback()
+            raise
+        except BaseException:
+            # Cancelled (or worse) mid-batch: the entries were already taken off the queue
+            self._pending.extendleft(reversed(batch))
+            raise
+
+    async def _flush_with_new_session(self):
+        async with self._session_factory() as db:
+            await self.flush(db)
+
+    async def _run(self):
+        interval = settings.VIEW_LOG_FLUSH_INTERVAL_MS / 1000
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            if self._stopping or not self._pending:
+                continue
+            try:
+                await self._flush_with_new_session()
+            except SQLAlchemyError as e:
+                logger.error(f"View log flush error: {e}")
+            except Exception:
+                # Keep the flusher alive; the entries stay queued for the next pass
+                logger.exception("Unexpected view log flush error")
+
+    def start(self, session_factory: async_sessionmaker):
+        """Start the background flusher on the running event loop"""
+        self._session_factory = session_factory
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background flusher and write whatever is still pending"""
+        if self._task:
+            # Let an in-flight flush finish instead of cancelling it mid-batch
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+        if self._session_factory and self._pending:
+            await self._flush_with_new_session()
+        self._wakeup = None
+
+# Global view log buffer instance
+view_log_buffer = ViewLogBuffer()
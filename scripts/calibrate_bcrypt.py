@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Calibrate BCRYPT_ROUNDS for this machine
+Times hash_password across cost factors so you can pick the one closest to
+the ~250 ms target, then set it as BCRYPT_ROUNDS in .env.
+
+Usage: python scripts/calibrate_bcrypt.py [target_ms]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.config import settings
+from app.security import hash_password
+
+ROUNDS = range(10, 15)
+SAMPLES = 3
+PASSWORD = "x" * 16
+
+def time_rounds(rounds: int) -> float:
+    """Return the best-of-SAMPLES hashing time in milliseconds"""
+    settings.BCRYPT_ROUNDS = rounds
+    best = float("inf")
+    for _ in range(SAMPLES):
+        start = time.perf_counter()
+        hash_password(PASSWORD)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def main():
+    target_ms = float(sys.argv[1]) if len(sys.argv) > 1 else 250.0
+    configured = settings.BCRYPT_ROUNDS
+
+    print(f"⏱️  Calibrating bcrypt (target {target_ms:.0f} ms/hash)\n")
+    timings = {}
+    for rounds in ROUNDS:
+        timings[rounds] = time_rounds(rounds)
+        marker = "  (current)" if rounds == configured else ""
+        print(f"   rounds={rounds:2d}: {timings[rounds]:8.1f} ms/op{marker}")
+
+    best = min(timings, key=lambda r: abs(timings[r] - target_ms))
+    print(f"\n✅ Suggested: BCRYPT_ROUNDS={best} ({timings[best]:.1f} ms/op)")
+
+if __name__ == "__main__":
+    main()
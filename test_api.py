@@ -4,9 +4,9 @@ Test script for FastAPI Media Backend
 Tests all endpoints: signup, login, media upload, and streaming
 """
 
+import io
 import requests
 import json
-import os
 from pathlib import Path
 
 # Configuration
@@ -57,13 +57,8 @@ def test_media_upload(token):
     """Test media upload"""
     print("📤 Testing media upload...")
     
-    # Create a small test file
-    test_file_path = "/tmp/test_video.txt"
-    with open(test_file_path, "w") as f:
-        f.write("This is a test video file content")
-    
     headers = {"Authorization": f"Bearer {token}"}
-    files = {"file": ("test_video.mp4", open(test_file_path, "rb"), "video/mp4")}
+    files = {"file": ("test_video.mp4", io.BytesIO(b"This is a test video file content"), "video/mp4")}
     data = {"title": "Test Video", "type": "video"}
     
     response = requests.post(f"{BASE_URL}/media/", headers=headers, files=files, data=data)
@@ -72,9 +67,6 @@ def test_media_upload(token):
     assert response.status_code == 200
     media_id = response.json()["id"]
     print(f"✅ Media upload successful! Media ID: {media_id}\n")
-    
-    # Clean up test file
-    os.unlink(test_file_path)
     return media_id
 
 def test_stream_url(token, media_id):
@@ -4,19 +4,19 @@ Complete FastAPI Media Backend Test Suite
 Run this to verify all functionality works correctly.
 """
 
-import subprocess
+import io
 import time
-import json
-import os
+import httpx
 from datetime import datetime
 
-def run_curl(cmd):
-    """Run a curl command and return the response"""
+def run_request(client, method, url, **kwargs):
+    """Send a request on the shared client and return (response, error)"""
     try:
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=10)
-        return result.returncode, result.stdout.strip(), result.stderr.strip()
-    except subprocess.TimeoutExpired:
-        return -1, "", "Timeout"
+        return client.request(method, url, **kwargs), ""
+    except httpx.TimeoutException:
+        return None, "Timeout"
+    except httpx.HTTPError as e:
+        return None, str(e)
 
 def test_api():
     """Test the complete API workflow"""
@@ -28,30 +28,33 @@ def test_api():
     print("🚀 FastAPI Media Backend - Complete Test Suite")
     print("=" * 60)
     
+    # One client for the whole run so every step reuses the same connection
+    with httpx.Client(base_url=base_url, timeout=10) as client:
+        return run_steps(client, base_url, test_email, test_password)
+
+def run_steps(client, base_url, test_email, test_password):
     # Test 1: Root endpoint
     print("\n1. 🔍 Testing Root Endpoint...")
-    code, response, error = run_curl(f'curl -s {base_url}/')
-    if code == 0:
+    response, error = run_request(client, "GET", "/")
+    if response is not None:
         try:
-            data = json.loads(response)
+            data = response.json()
             print(f"   ✅ Status: Success")
             print(f"   📄 Response: {data}")
-        except:
-            print(f"   ❌ Invalid JSON response: {response}")
+        except ValueError:
+            print(f"   ❌ Invalid JSON response: {response.text}")
     else:
         print(f"   ❌ Error: {error}")
         return False
     
     # Test 2: User Signup
     print("\n2. 📝 Testing User Signup...")
-    signup_cmd = f'''curl -s -X POST {base_url}/auth/signup \\
-        -H "Content-Type: application/json" \\
-        -d '{{"email":"{test_email}","password":"{test_password}"}}"'''
-    
-    code, response, error = run_curl(signup_cmd)
-    if code == 0:
+    response, error = run_request(
+        client, "POST", "/auth/signup", json={"email": test_email, "password": test_password}
+    )
+    if response is not None:
         try:
-            data = json.loads(response)
+            data = response.json()
             if 'access_token' in data:
                 token = data['access_token']
                 print(f"   ✅ Status: Success")
@@ -59,8 +62,8 @@ def test_api():
             else:
                 print(f"   ❌ No token in response: {data}")
                 return False
-        except:
-            print(f"   ❌ Invalid JSON response: {response}")
+        except ValueError:
+            print(f"   ❌ Invalid JSON response: {response.text}")
             return False
     else:
         print(f"   ❌ Error: {error}")
@@ -68,20 +71,18 @@ def test_api():
     
     # Test 3: Create test file and upload media
     print("\n3. 📤 Testing Media Upload...")
-    test_file = "/tmp/test_media.mp4"
-    with open(test_file, "w") as f:
-        f.write("This is test media content for the FastAPI backend")
-    
-    upload_cmd = f'''curl -s -X POST {base_url}/media/ \\
-        -H "Authorization: Bearer {token}" \\
-        -F "title=Test Media Upload" \\
-        -F "type=video" \\
-        -F "file=@{test_file}"'''
-    
-    code, response, error = run_curl(upload_cmd)
-    if code == 0:
+    headers = {"Authorization": f"Bearer {token}"}
+    test_file = io.BytesIO(b"This is test media content for the FastAPI backend")
+    
+    response, error = run_request(
+        client, "POST", "/media/",
+        headers=headers,
+        data={"title": "Test Media Upload", "type": "video"},
+        files={"file": ("test_media.mp4", test_file, "video/mp4")},
+    )
+    if response is not None:
         try:
-            data = json.loads(response)
+            data = response.json()
             if 'id' in data:
                 media_id = data['id']
                 print(f"   ✅ Status: Success")
@@ -90,8 +91,8 @@ def test_api():
             else:
                 print(f"   ❌ No media ID in response: {data}")
                 return False
-        except:
-            print(f"   ❌ Invalid JSON response: {response}")
+        except ValueError:
+            print(f"   ❌ Invalid JSON response: {response.text}")
             return False
     else:
         print(f"   ❌ Error: {error}")
@@ -99,13 +100,10 @@ def test_api():
     
     # Test 4: Get stream URL
     print("\n4. 🔗 Testing Stream URL Generation...")
-    stream_cmd = f'''curl -s -X GET {base_url}/media/{media_id}/stream-url \\
-        -H "Authorization: Bearer {token}"'''
-    
-    code, response, error = run_curl(stream_cmd)
-    if code == 0:
+    response, error = run_request(client, "GET", f"/media/{media_id}/stream-url", headers=headers)
+    if response is not None:
         try:
-            data = json.loads(response)
+            data = response.json()
             if 'stream_url' in data:
                 stream_url = data['stream_url']
                 print(f"   ✅ Status: Success")
@@ -113,8 +111,8 @@ def test_api():
             else:
                 print(f"   ❌ No stream URL in response: {data}")
                 return False
-        except:
-            print(f"   ❌ Invalid JSON response: {response}")
+        except ValueError:
+            print(f"   ❌ Invalid JSON response: {response.text}")
             return False
     else:
         print(f"   ❌ Error: {error}")
@@ -122,44 +120,36 @@ def test_api():
     
     # Test 5: Test streaming access
     print("\n5. 🎬 Testing File Streaming...")
-    stream_test_cmd = f'curl -s -I "{stream_url}"'
-    
-    code, response, error = run_curl(stream_test_cmd)
-    if code == 0 and "200 OK" in response:
+    response, error = run_request(client, "GET", stream_url)
+    if response is not None and response.status_code == 200:
         print(f"   ✅ Status: Success")
-        print(f"   📊 Headers preview: {response.split()[0:3]}")
+        print(f"   📊 Headers preview: {[response.http_version, str(response.status_code), response.reason_phrase]}")
     else:
         print(f"   ❌ Stream test failed")
-        print(f"   📄 Response: {response}")
+        print(f"   📄 Response: {response.headers if response is not None else error}")
     
     # Test 6: Manual view logging (NEW - Task 2)
     print("\n6. 📊 Testing Manual View Logging...")
-    view_log_cmd = f'''curl -s -X POST {base_url}/media/{media_id}/view \\
-        -H "Authorization: Bearer {token}"'''
-    
-    code, response, error = run_curl(view_log_cmd)
-    if code == 0:
+    response, error = run_request(client, "POST", f"/media/{media_id}/view", headers=headers)
+    if response is not None:
         try:
-            data = json.loads(response)
+            data = response.json()
             if 'message' in data:
                 print(f"   ✅ Status: Success")
                 print(f"   📄 Response: {data}")
             else:
                 print(f"   ❌ Invalid view log response: {data}")
-        except:
-            print(f"   ❌ Invalid JSON response: {response}")
+        except ValueError:
+            print(f"   ❌ Invalid JSON response: {response.text}")
     else:
         print(f"   ❌ View logging failed: {error}")
     
     # Test 7: Analytics endpoint (NEW - Task 2)
     print("\n7. 📈 Testing Analytics...")
-    analytics_cmd = f'''curl -s -X GET {base_url}/media/{media_id}/analytics \\
-        -H "Authorization: Bearer {token}"'''
-    
-    code, response, error = run_curl(analytics_cmd)
-    if code == 0:
+    response, error = run_request(client, "GET", f"/media/{media_id}/analytics", headers=headers)
+    if response is not None:
         try:
-            data = json.loads(response)
+            data = response.json()
             if 'total_views' in data:
                 print(f"   ✅ Status: Success")
                 print(f"   📊 Total Views: {data.get('total_views', 0)}")
@@ -167,17 +157,11 @@ def test_api():
                 print(f"   📅 Views per day: {len(data.get('views_per_day', {})) } days")
             else:
                 print(f"   ❌ Invalid analytics response: {data}")
-        except:
-            print(f"   ❌ Invalid JSON response: {response}")
+        except ValueError:
+            print(f"   ❌ Invalid JSON response: {response.text}")
     else:
         print(f"   ❌ Analytics failed: {error}")
     
-    # Cleanup
-    try:
-        os.unlink(test_file)
-    except:
-        pass
-    
     print("\n" + "=" * 60)
     print("🎉 Test Suite Complete!")
     print("\n📋 Summary:")
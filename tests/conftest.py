@@ -0,0 +1,27 @@
+"""
+Shared pytest fixtures
+"""
+import os
+import shutil
+import tempfile
+import pytest
+
+# Uploads go to a throwaway directory; set before app.config builds settings
+# (app.media resolves the storage path at import)
+_TEST_STORAGE_DIR = tempfile.mkdtemp(prefix="media-test-storage-")
+os.environ["STORAGE_DIR"] = _TEST_STORAGE_DIR
+
+from app.config import settings
+
+@pytest.fixture(scope="session", autouse=True)
+def fast_password_hashing():
+    """Hash with bcrypt's minimum cost so signup tests don't pay production-grade work"""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(settings, "BCRYPT_ROUNDS", 4)
+        yield
+
+@pytest.fixture(scope="session", autouse=True)
+def test_storage_dir():
+    """Remove the uploads written during the run"""
+    yield _TEST_STORAGE_DIR
+    shutil.rmtree(_TEST_STORAGE_DIR, ignore_errors=True)
@@ -0,0 +1,112 @@
+"""
+Tests for the Redis cache service against an in-process fake Redis
+"""
+import pytest
+import pytest_asyncio
+import fakeredis
+import redis
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+from app.cache import CacheService
+from app.config import settings
+from app.schemas import AnalyticsRecord
+
+def make_record(media_id: int) -> AnalyticsRecord:
+    return AnalyticsRecord(
+        media_id=media_id,
+        media_filename=f"Video {media_id}",
+        total_views=media_id * 10,
+        unique_viewers=media_id,
+        recent_views_7days=media_id * 2,
+        views_per_day={"2025-08-17": media_id * 10},
+        upload_date=datetime(2025, 8, 1, 12, 0, 0),
+    )
+
+@pytest_asyncio.fixture
+async def cache():
+    """A CacheService connected to a fresh fake Redis server"""
+    service = CacheService()
+    await service.connect(fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer()))
+    assert service.enabled
+    yield service
+    await service.close()
+
+class TestBulkAnalytics:
+    """Test the MGET / pipelined SETEX helpers"""
+
+    @pytest.mark.asyncio
+    async def test_set_and_get_many_analytics(self, cache):
+        """Test that records written in one pipeline come back from one MGET"""
+        assert await cache.set_many_analytics([make_record(1), make_record(2)])
+
+        cached = await cache.get_many_analytics([1, 2, 3])
+        assert set(cached) == {1, 2}  # missing media 3 is skipped
+        assert cached[1] == make_record(1)
+        assert cached[2] == make_record(2)
+        assert await cache.redis_client.ttl("analytics:media:1") > 0
+
+    @pytest.mark.asyncio
+    async def test_get_many_analytics_empty(self, cache):
+        """Test that an empty lookup doesn't touch Redis"""
+        assert await cache.get_many_analytics([]) == {}
+
+class TestViewCounters:
+    """Test seeding the Redis view counters and recording views against them"""
+    NOW = datetime(2025, 8, 17, 12, 0, 0, tzinfo=timezone.utc)
+    CUTOFF = NOW - timedelta(milliseconds=settings.ANALYTICS_SETTLE_MS)
+
+    @pytest.mark.asyncio
+    async def test_record_view_before_and_after_seed(self, cache):
+        """Test that counters only move once seeded, and then track every view"""
+        # Not seeded yet: the view only lands in the recent-views window
+        assert await cache.record_view(1, "10.0.0.2", self.NOW)
+        assert await cache.get_view_counters(1) is None
+
+        # The snapshot holds the settled view; the newer one comes from the window
+        assert await cache.seed_view_counters(1, self.CUTOFF, 1, {"2025-08-16": 1}, ["10.0.0.1"])
+        assert await cache.get_view_counters(1) == (2, 2, {"2025-08-16": 1, "2025-08-17": 1})
+
+        assert await cache.record_view(1, "10.0.0.3", self.NOW + timedelta(seconds=1))
+        assert await cache.get_view_counters(1) == (3, 3, {"2025-08-16": 1, "2025-08-17": 2})
+        assert await cache.redis_client.ttl("analytics:vpd:1") > 0
+        # The staged snapshot IPs are merged and dropped
+        assert await cache.redis_client.keys("analytics:uip-seed:*") == []
+
+    @pytest.mark.asyncio
+    async def test_views_before_cutoff_come_from_snapshot_only(self, cache):
+        """Test that a view both in the snapshot and in the window is counted once"""
+        settled = self.CUTOFF - timedelta(milliseconds=1)
+        await cache.record_view(1, "10.0.0.1", settled)
+        await cache.record_view(1, "10.0.0.1", self.CUTOFF)
+
+        assert await cache.seed_view_counters(1, self.CUTOFF, 1, {"2025-08-17": 1}, ["10.0.0.1"])
+        assert await cache.get_view_counters(1) == (2, 1, {"2025-08-17": 2})
+
+    @pytest.mark.asyncio
+    async def test_counters_reseed_after_lost_record(self, cache):
+        """Test that a view Redis never recorded is picked up again on the next seed"""
+        assert await cache.seed_view_counters(1, self.CUTOFF, 1, {"2025-08-16": 1}, ["10.0.0.1"])
+
+        with patch.object(cache, "_record_view_script", side_effect=redis.ConnectionError("down")):
+            assert not await cache.record_view(1, "10.0.0.2", self.NOW)
+        assert (await cache.get_view_counters(1))[0] == 1
+
+        # Counters expire; the view reached the database and is settled by the next miss
+        await cache.redis_client.delete("analytics:views:1")
+        later = self.NOW + timedelta(minutes=1)
+        assert await cache.seed_view_counters(
+            1, later, 2, {"2025-08-16": 1, "2025-08-17": 1}, ["10.0.0.1", "10.0.0.2"]
+        )
+        assert await cache.get_view_counters(1) == (2, 2, {"2025-08-16": 1, "2025-08-17": 1})
+
+    @pytest.mark.asyncio
+    async def test_recent_views_window_is_trimmed(self, cache):
+        """Test that the window only keeps views a seed may still need"""
+        await cache.record_view(1, "10.0.0.1", self.NOW)
+        await cache.record_view(1, "10.0.0.1", self.NOW)  # same IP, same instant: still two views
+        assert await cache.redis_client.zcard("analytics:recent:1") == 2
+
+        await cache.record_view(1, "10.0.0.2", self.NOW + timedelta(milliseconds=settings.ANALYTICS_SETTLE_MS * 2 + 1))
+        assert await cache.redis_client.zcard("analytics:recent:1") == 1
+        assert 0 < await cache.redis_client.pttl("analytics:recent:1") <= settings.ANALYTICS_SETTLE_MS * 2
@@ -0,0 +1,25 @@
+"""
+Tests for DATABASE_URL handling
+"""
+import pytest
+
+from app.database import async_database_url
+
+class TestAsyncDatabaseUrl:
+    """Test that every accepted URL ends up on an async driver"""
+
+    @pytest.mark.parametrize("url, expected", [
+        ("sqlite:///./media.db", "sqlite+aiosqlite:///./media.db"),
+        ("postgresql://user:pw@db/media", "postgresql+asyncpg://user:pw@db/media"),
+        ("postgres://user:pw@db/media", "postgresql+asyncpg://user:pw@db/media"),
+        ("postgresql+asyncpg://user:pw@db/media", "postgresql+asyncpg://user:pw@db/media"),
+        ("sqlite+aiosqlite:///./media.db", "sqlite+aiosqlite:///./media.db"),
+    ])
+    def test_driver_filled_in(self, url, expected):
+        """Test that URLs without a driver get the async one"""
+        assert async_database_url(url).render_as_string(hide_password=False) == expected
+
+    def test_sync_driver_rejected(self):
+        """Test that an explicit synchronous driver fails at startup, naming the scheme to use"""
+        with pytest.raises(ValueError, match=r"postgresql\+asyncpg://"):
+            async_database_url("postgresql+psycopg2://user:pw@db/media")
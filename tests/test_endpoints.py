@@ -3,12 +3,15 @@ Comprehensive test suite for Task 1, 2, and 3 features
 Tests authentication, media upload, streaming, analytics, caching, and rate limiting
 """
 import pytest
+import asyncio
 import io
 import time
 import json
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from unittest.mock import Mock, patch
 
 # Import our app components
@@ -16,32 +19,60 @@ from app.main import app
 from app.database import get_db, Base
 from app import models
 from app.config import settings
+from app.security import jwt, create_access_token, _token_cache, _user_cache
+from app.media import _media_cache
+from app.schemas import AnalyticsRecord
+from app.view_log_buffer import view_log_buffer
+from datetime import datetime, timedelta, timezone
 
-# Test database setup
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+# Test database setup: a named in-memory database with a shared cache, so no DDL hits the disk.
+# The StaticPool engine keeps one connection open, which keeps the database alive
+SQLALCHEMY_DATABASE_URL = "sqlite:///file:testdb?mode=memory&cache=shared&uri=true"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}, poolclass=StaticPool)
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# The app itself talks to the same database through the async driver
+async_engine = create_async_engine(
+    "sqlite+aiosqlite:///file:testdb?mode=memory&cache=shared&uri=true",
+    connect_args={"check_same_thread": False},
+)
+AsyncTestingSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
 # Override the database dependency
-def override_get_db():
-    try:
-        db = TestingSessionLocal()
+async def override_get_db():
+    async with AsyncTestingSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 app.dependency_overrides[get_db] = override_get_db
 
+async def flush_view_logs():
+    async with AsyncTestingSessionLocal() as db:
+        await view_log_buffer.flush(db)
+
 # Create test client
 client = TestClient(app)
 
-@pytest.fixture(autouse=True)
-def setup_test_database():
-    """Create and clean up test database for each test"""
+@pytest.fixture(scope="session", autouse=True)
+def setup_test_schema():
+    """Create the test database schema once for the whole run"""
     Base.metadata.create_all(bind=engine)
     yield
     Base.metadata.drop_all(bind=engine)
 
+@pytest.fixture(autouse=True)
+def setup_test_database():
+    """Start each test with cold in-process caches, and empty every table after it"""
+    # Tables are emptied (and ids reused) between tests, so cached rows and tokens would be stale
+    _token_cache.clear()
+    _user_cache.clear()
+    _media_cache.clear()
+    yield
+    # Don't let buffered views leak into the next test's database
+    asyncio.run(flush_view_logs())
+    with engine.begin() as conn:
+        for table in reversed(Base.metadata.sorted_tables):
+            conn.execute(table.delete())
+
 @pytest.fixture
 def test_admin():
     """Create a test admin user"""
@@ -60,7 +91,7 @@ def test_admin():
 def auth_token():
     """Get JWT token for testing"""
     # Mock the password verification
-    with patch('app.auth.verify_password') as mock_verify:
+    with patch('app.auth.averify_password') as mock_verify:
         mock_verify.return_value = True
         
         response = client.post(
@@ -100,7 +131,7 @@ class TestTask1BasicBackend:
     
     def test_auth_login(self, test_admin):
         """Test user login"""
-        with patch('app.auth.verify_password') as mock_verify:
+        with patch('app.auth.averify_password') as mock_verify:
             mock_verify.return_value = True
             
             response = client.post(
@@ -153,6 +184,29 @@ class TestTask1BasicBackend:
         data = response.json()
         assert "stream_url" in data
     
+    def test_media_stream_download(self, test_admin, auth_headers):
+        """Test that a signed stream URL serves the uploaded file"""
+        test_file = io.BytesIO(b"fake video content")
+        upload_response = client.post(
+            "/media/",
+            files={"file": ("test_video.mp4", test_file, "video/mp4")},
+            data={"title": "Test Video", "type": "video"},
+            headers=auth_headers
+        )
+        media_id = upload_response.json()["id"]
+        stream_url = client.get(f"/media/{media_id}/stream-url", headers=auth_headers).json()["stream_url"]
+        
+        response = client.get(stream_url)
+        assert response.status_code == 200
+        assert response.content == b"fake video content"
+        
+        # Behind nginx the app only hands off the file location
+        with patch.object(settings, "ACCEL_REDIRECT_PREFIX", "/_protected"):
+            response = client.get(stream_url)
+        assert response.status_code == 200
+        assert response.headers["x-accel-redirect"].startswith("/_protected/")
+        assert response.content == b""
+    
     def test_unauthorized_access(self):
         """Test that endpoints require authentication"""
         # Test upload without auth
@@ -226,8 +280,42 @@ class TestTask2Analytics:
         assert data["total_views"] == 3
         assert data["unique_viewers"] == 1  # Same IP
         assert data["recent_views_7days"] == 3
+        assert sum(data["views_per_day"].values()) == 3
         assert "upload_date" in data
     
+    def test_recent_views_boundary(self, test_admin, auth_headers):
+        """Test that the database and the view counters agree on views around the 7-day boundary"""
+        test_file = io.BytesIO(b"fake video content")
+        upload_response = client.post(
+            "/media/",
+            files={"file": ("test_video.mp4", test_file, "video/mp4")},
+            data={"title": "Test Video", "type": "video"},
+            headers=auth_headers
+        )
+        media_id = upload_response.json()["id"]
+        
+        # Recent views count whole days: from midnight (UTC) of the day 7 days ago
+        now = datetime.now(timezone.utc)
+        recent_since = (now - timedelta(days=7)).replace(hour=0, minute=0, second=0, microsecond=0)
+        timestamps = [recent_since - timedelta(seconds=1), recent_since, now - timedelta(days=7, seconds=1), now]
+        db = TestingSessionLocal()
+        db.add_all(
+            models.MediaViewLog(media_id=media_id, viewed_by_ip="127.0.0.1", timestamp=ts.replace(tzinfo=None))
+            for ts in timestamps
+        )
+        db.commit()
+        db.close()
+        expected_recent = sum(ts >= recent_since for ts in timestamps)
+        
+        from_db = client.get(f"/media/{media_id}/analytics", headers=auth_headers).json()
+        assert from_db["total_views"] == 4
+        assert from_db["recent_views_7days"] == expected_recent
+        
+        with patch('app.cache.cache_service.get_view_counters') as mock_get_counters:
+            mock_get_counters.return_value = (4, 1, from_db["views_per_day"])
+            from_counters = client.get(f"/media/{media_id}/analytics", headers=auth_headers).json()
+        assert from_counters["recent_views_7days"] == expected_recent
+    
     def test_analytics_nonexistent_media(self, test_admin, auth_headers):
         """Test analytics for non-existent media"""
         response = client.get("/media/999/analytics", headers=auth_headers)
@@ -241,14 +329,15 @@ class TestTask3ProductionFeatures:
     def test_analytics_caching(self, mock_get_analytics, test_admin, auth_headers):
         """Test Redis caching for analytics"""
         # Mock cache to simulate cache hit
-        mock_get_analytics.return_value = {
-            "media_id": 1,
-            "media_filename": "test.mp4",
-            "total_views": 5,
-            "unique_viewers": 3,
-            "recent_views_7days": 2,
-            "upload_date": "2024-01-01T12:00:00"
-        }
+        mock_get_analytics.return_value = AnalyticsRecord(
+            media_id=1,
+            media_filename="test.mp4",
+            total_views=5,
+            unique_viewers=3,
+            recent_views_7days=2,
+            views_per_day={"2024-01-01": 5},
+            upload_date=datetime(2024, 1, 1, 12, 0, 0)
+        )
         
         # Upload a file first
         test_file = io.BytesIO(b"fake video content")
@@ -267,6 +356,29 @@ class TestTask3ProductionFeatures:
         # Verify cache was called
         mock_get_analytics.assert_called_once_with(media_id)
     
+    @patch('app.cache.cache_service.get_view_counters')
+    def test_analytics_from_view_counters(self, mock_get_counters, test_admin, auth_headers):
+        """Test that analytics are served from the Redis view counters when seeded"""
+        today = datetime.utcnow().date().isoformat()
+        mock_get_counters.return_value = (7, 4, {"2020-01-01": 2, today: 5})
+        
+        test_file = io.BytesIO(b"fake video content")
+        upload_response = client.post(
+            "/media/",
+            files={"file": ("test.mp4", test_file, "video/mp4")},
+            data={"title": "Test", "type": "video"},
+            headers=auth_headers
+        )
+        media_id = upload_response.json()["id"]
+        
+        response = client.get(f"/media/{media_id}/analytics", headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["total_views"] == 7
+        assert data["unique_viewers"] == 4
+        assert data["recent_views_7days"] == 5
+        assert data["views_per_day"] == {"2020-01-01": 2, today: 5}
+    
     def test_rate_limiting_view_endpoint(self, test_admin, auth_headers):
         """Test rate limiting on view logging endpoint"""
         # Upload a file
@@ -294,20 +406,8 @@ class TestTask3ProductionFeatures:
         assert len(success_responses) > 0  # Some should succeed
         assert len(rate_limited_responses) > 0  # Some should be rate limited
     
-    def test_cache_invalidation_on_new_view(self, test_admin, auth_headers):
-        """Test that cache is invalidated when new views are logged"""
-        # Upload a file
-        test_file = io.BytesIO(b"fake video content")
-        upload_response = client.post(
-            "/media/",
-            files={"file": ("test_video.mp4", test_file, "video/mp4")},
-            data={"title": "Test Video", "type": "video"},
-            headers=auth_headers
-        )
-        media_id = upload_response.json()["id"]
-        
-    @patch('app.cache.cache_service.invalidate_analytics')
-    def test_cache_invalidation_on_new_view(self, mock_invalidate, test_admin, auth_headers):
+    @patch('app.cache.cache_service.record_view')
+    def test_cache_invalidation_on_new_view(self, mock_record_view, test_admin, auth_headers):
         """Test that cache is invalidated when new views are logged"""
         # Upload a file
         test_file = io.BytesIO(b"fake video content")
@@ -326,10 +426,49 @@ class TestTask3ProductionFeatures:
             assert response.status_code == 200
             
             # Verify cache invalidation was called
-            mock_invalidate.assert_called_once_with(media_id)
+            mock_record_view.assert_called_once()
+            assert mock_record_view.call_args.args[0] == media_id
+    
+    def test_token_decode_cached(self, test_admin, auth_token):
+        """Test that a token is only decoded once while it stays valid"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        with patch('app.security.jwt.decode', wraps=jwt.decode) as mock_decode:
+            assert client.get("/media/999/analytics", headers=headers).status_code == 404
+            assert client.get("/media/999/analytics", headers=headers).status_code == 404
+        assert mock_decode.call_count == 1
+
+    def test_current_user_cached(self, test_admin, auth_headers):
+        """Test that a recently authenticated user is not fetched from the database again"""
+        with patch.object(AsyncSession, "get", autospec=True, side_effect=AsyncSession.get) as mock_get:
+            assert client.get("/media/999/analytics", headers=auth_headers).status_code == 404
+        mock_get.assert_called_once()
+        
+        with patch.object(AsyncSession, "get") as mock_get:
+            assert client.get("/media/999/analytics", headers=auth_headers).status_code == 404
+        mock_get.assert_not_called()
+
+    def test_token_with_non_numeric_subject(self, test_admin):
+        """Test that a validly signed token with a bad subject is rejected, not a 500"""
+        token = create_access_token("not-a-number")
+        response = client.get("/media/999/analytics", headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 401
+
+    def test_token_signing_follows_settings(self, test_admin):
+        """Test that tokens are signed with the current secret and algorithm, the ones decode checks"""
+        old_token = create_access_token(str(test_admin.id))
+        with patch.object(settings, "JWT_SECRET", "rotated-secret-for-tests-" + "0" * 40), \
+                patch.object(settings, "JWT_ALG", "HS512"):
+            token = create_access_token(str(test_admin.id))
+            assert jwt.get_unverified_header(token)["alg"] == "HS512"
+            assert jwt.decode(token, settings.JWT_SECRET, algorithms=["HS512"])["sub"] == str(test_admin.id)
+            
+            response = client.get("/media/999/analytics", headers={"Authorization": f"Bearer {token}"})
+            assert response.status_code == 404  # authenticated; the media just doesn't exist
+            response = client.get("/media/999/analytics", headers={"Authorization": f"Bearer {old_token}"})
+            assert response.status_code == 401
     
     def test_streaming_url_signature_validation(self, test_admin, auth_headers):
-        """Test that streaming URLs have proper HMAC signatures"""
+        """Test that streaming URLs carry a 128-bit signature"""
         # Upload a file
         test_file = io.BytesIO(b"fake video content")
         upload_response = client.post(
@@ -349,6 +488,18 @@ class TestTask3ProductionFeatures:
         # URL should contain expiration and signature parameters
         assert "exp=" in stream_url
         assert "sig=" in stream_url
+        
+        # 16 bytes of signature, hex-encoded
+        signed_path, sig = stream_url.split("&sig=")
+        assert len(sig) == 32
+        int(sig, 16)
+        
+        # A truncated, padded or non-ASCII signature is rejected without being hashed
+        with patch('app.utils.sign_stream_path') as mock_sign:
+            assert client.get(f"{signed_path}&sig={sig[:-1]}").status_code == 403
+            assert client.get(f"{signed_path}&sig={sig}0").status_code == 403
+            assert client.get(signed_path, params={"sig": "é" * 32}).status_code == 403
+        mock_sign.assert_not_called()
 
 class TestErrorHandling:
     """Test comprehensive error handling"""
@@ -383,6 +534,12 @@ class TestErrorHandling:
         # For now, test that the stream endpoint validates parameters
         response = client.get("/media/stream/999")  # Non-existent media
         assert response.status_code in [404, 422]  # Not found or validation error
+        
+        # An expired link is rejected before its signature is even checked
+        with patch('app.media.verify_stream_signature') as mock_verify:
+            response = client.get("/media/stream/1", params={"exp": int(time.time()) - 1, "sig": "0" * 32})
+            assert response.status_code == 403
+            mock_verify.assert_not_called()
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
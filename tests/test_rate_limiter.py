@@ -0,0 +1,112 @@
+"""
+Tests for the token bucket rate limiter
+"""
+import pytest
+import pytest_asyncio
+import fakeredis
+from unittest.mock import patch
+from starlette.requests import Request
+
+from app.cache import cache_service
+from app.config import settings
+from app.rate_limiter import RateLimiter
+
+def make_request(ip: str = "10.0.0.1") -> Request:
+    return Request({"type": "http", "method": "POST", "path": "/", "headers": [], "client": (ip, 1234)})
+
+class TestLocalBucket:
+    """Test the in-process bucket used while Redis is unavailable"""
+
+    @pytest.mark.asyncio
+    async def test_refills_at_configured_rate_up_to_capacity(self):
+        """Test that tokens come back at limit/60s and never exceed the limit"""
+        limiter = RateLimiter()
+        capacity = settings.RATE_LIMIT_PER_MINUTE
+        seconds_per_token = 60 / capacity
+
+        with patch("app.rate_limiter.time") as mock_time:
+            mock_time.time.return_value = mock_time.monotonic.return_value = 1000.0
+            for _ in range(capacity):
+                assert (await limiter.check_rate_limit(make_request()))[0]
+            allowed, info = await limiter.check_rate_limit(make_request())
+            assert not allowed
+            assert info["retry_after"] == round(seconds_per_token)
+
+            # One token's worth of time buys exactly one request
+            mock_time.monotonic.return_value += seconds_per_token
+            assert (await limiter.check_rate_limit(make_request()))[0]
+            assert not (await limiter.check_rate_limit(make_request()))[0]
+
+            # A long idle spell refills to the cap, not beyond
+            mock_time.monotonic.return_value += 3600
+            allowed, info = await limiter.check_rate_limit(make_request())
+            assert allowed
+            assert info["remaining"] == capacity - 1
+
+    @pytest.mark.asyncio
+    async def test_buckets_are_per_client(self):
+        """Test that one client running dry doesn't limit another"""
+        limiter = RateLimiter()
+        for _ in range(settings.RATE_LIMIT_PER_MINUTE + 1):
+            await limiter.check_rate_limit(make_request("10.0.0.1"))
+
+        assert not (await limiter.check_rate_limit(make_request("10.0.0.1")))[0]
+        assert (await limiter.check_rate_limit(make_request("10.0.0.2")))[0]
+
+class TestRedisBucket:
+    """Test the shared Redis bucket against an in-process fake Redis"""
+
+    @pytest_asyncio.fixture
+    async def redis_cache(self):
+        """Point the global cache service at a fresh fake Redis server"""
+        await cache_service.connect(fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer()))
+        assert cache_service.enabled
+        yield cache_service
+        await cache_service.close()
+
+    @pytest.mark.asyncio
+    async def test_allow_then_deny_then_refill(self, redis_cache):
+        """Test that the shared bucket runs dry at the limit and refills over time"""
+        limiter = RateLimiter()
+        capacity = settings.RATE_LIMIT_PER_MINUTE
+        seconds_per_token = 60 / capacity
+
+        with patch("app.rate_limiter.time") as mock_time:
+            mock_time.time.return_value = 1000.0
+            for _ in range(capacity):
+                assert (await limiter.check_rate_limit(make_request()))[0]
+            allowed, info = await limiter.check_rate_limit(make_request())
+            assert not allowed
+            assert info["remaining"] == 0
+            assert info["retry_after"] == round(seconds_per_token)
+
+            mock_time.time.return_value += seconds_per_token
+            assert (await limiter.check_rate_limit(make_request()))[0]
+            assert not (await limiter.check_rate_limit(make_request()))[0]
+
+        # Served from Redis, not the in-process fallback
+        assert limiter._buckets == {}
+
+    @pytest.mark.asyncio
+    async def test_bucket_key_expires(self, redis_cache):
+        """Test that idle buckets expire after two windows"""
+        limiter = RateLimiter()
+        await limiter.check_rate_limit(make_request())
+
+        ttl = await redis_cache.redis_client.pttl("rl:10.0.0.1")
+        assert 119_000 < ttl <= 120_000
+
+    @pytest.mark.asyncio
+    async def test_script_follows_reconnect(self, redis_cache):
+        """Test that the script is registered again on the client a reconnect creates"""
+        limiter = RateLimiter()
+        await limiter.check_rate_limit(make_request())
+        old_client = redis_cache.redis_client
+
+        await redis_cache.close()
+        await redis_cache.connect(fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer()))
+        assert (await limiter.check_rate_limit(make_request()))[0]
+
+        assert limiter._redis_bucket.registered_client is redis_cache.redis_client is not old_client
+        assert limiter._buckets == {}
+        assert await redis_cache.redis_client.exists("rl:10.0.0.1")
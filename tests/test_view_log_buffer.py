@@ -0,0 +1,106 @@
+"""
+Tests for the batched view log writer
+"""
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.view_log_buffer import ViewLogBuffer
+
+class FakeSessionFactory:
+    """async_sessionmaker stand-in handing out one mocked session"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __call__(self):
+        factory = MagicMock()
+        factory.__aenter__ = AsyncMock(return_value=self.db)
+        factory.__aexit__ = AsyncMock(return_value=False)
+        return factory
+
+class TestViewLogBuffer:
+    """Test that queued views survive cancellation and flusher errors"""
+
+    @pytest.mark.asyncio
+    async def test_cancelled_flush_requeues_batch(self):
+        """Test that a flush cancelled mid-batch puts its entries back"""
+        buffer = ViewLogBuffer()
+        buffer.add(1, "10.0.0.1")
+        buffer.add(1, "10.0.0.2")
+
+        started = asyncio.Event()
+        async def hang(*args, **kwargs):
+            started.set()
+            await asyncio.Event().wait()
+
+        db = MagicMock(execute=AsyncMock(side_effect=hang), commit=AsyncMock(), rollback=AsyncMock())
+        flush = asyncio.create_task(buffer.flush(db))
+        await started.wait()
+        flush.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await flush
+
+        assert [entry["viewed_by_ip"] for entry in buffer._pending] == ["10.0.0.1", "10.0.0.2"]
+
+    @pytest.mark.asyncio
+    async def test_flusher_survives_unexpected_errors(self):
+        """Test that the background flusher keeps running after a non-database error"""
+        buffer = ViewLogBuffer()
+        db = MagicMock(execute=AsyncMock(side_effect=[RuntimeError("boom"), None]), commit=AsyncMock(), rollback=AsyncMock())
+        buffer.start(FakeSessionFactory(db))
+        try:
+            buffer.add(1, "10.0.0.1")
+            for _ in range(100):
+                if not buffer._pending:
+                    break
+                await asyncio.sleep(0.05)
+            assert not buffer._pending
+            assert db.execute.await_count == 2
+            assert not buffer._task.done()
+        finally:
+            await buffer.stop()
+
+    @pytest.mark.asyncio
+    async def test_stop_writes_pending_views(self):
+        """Test that stopping the flusher writes what is still queued"""
+        buffer = ViewLogBuffer()
+        db = MagicMock(execute=AsyncMock(), commit=AsyncMock(), rollback=AsyncMock())
+        buffer.start(FakeSessionFactory(db))
+        buffer.add(1, "10.0.0.1")
+        await buffer.stop()
+
+        assert not buffer._pending
+        db.execute.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_flush_media_writes_only_that_media(self):
+        """Test that an analytics miss doesn't drain every other media's pending views"""
+        buffer = ViewLogBuffer()
+        buffer.add(1, "10.0.0.1")
+        buffer.add(2, "10.0.0.2")
+        buffer.add(1, "10.0.0.3")
+        db = MagicMock(execute=AsyncMock(), commit=AsyncMock(), rollback=AsyncMock())
+
+        assert await buffer.flush_media(db, 1) == 2
+        written = db.execute.await_args.args[1]
+        assert [entry["viewed_by_ip"] for entry in written] == ["10.0.0.1", "10.0.0.3"]
+        assert [entry["media_id"] for entry in buffer._pending] == [2]
+
+        # Nothing queued for it: no database round-trip
+        assert await buffer.flush_media(db, 3) == 0
+        db.execute.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_flush_media_requeues_on_error(self):
+        """Test that a failed per-media flush keeps the entries queued"""
+        buffer = ViewLogBuffer()
+        buffer.add(1, "10.0.0.1")
+        buffer.add(2, "10.0.0.2")
+        db = MagicMock(execute=AsyncMock(side_effect=SQLAlchemyError("locked")), commit=AsyncMock(), rollback=AsyncMock())
+
+        with pytest.raises(SQLAlchemyError):
+            await buffer.flush_media(db, 1)
+        assert sorted(entry["media_id"] for entry in buffer._pending) == [1, 2]
+        db.rollback.assert_awaited_once()